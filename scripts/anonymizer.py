@@ -0,0 +1,480 @@
+"""
+Anonymization of recorded Mastodon API traffic.
+
+Used by anonymize_traffic.py, which provides the command line interface.
+The module is fully type-annotated so it can be compiled with mypyc
+(`just compile-anonymizer`). The compiled extension is imported instead of
+this file whenever it sits next to it; anonymize_traffic.py refuses to run
+while it is older than this file.
+"""
+
+import hashlib
+import importlib
+import json
+import re
+import secrets
+import sys
+from typing import Any, Callable, Final, Iterable
+
+
+def _optional_import(name: str) -> Any:
+    """Import an optional accelerator module, or return None if missing."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+# Optional: orjson parses and serializes JSON several times faster
+orjson = _optional_import("orjson")
+
+
+def _json_loads(data: str | bytes) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than json: it rejects lone surrogate
+            # escapes (text truncated mid-emoji), integers above 64 bits
+            # and NaN. Such documents still have to be anonymized.
+            pass
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            result: bytes = orjson.dumps(obj)
+            return result
+        except TypeError:
+            # Integers above 64 bits or lone surrogates; handled below
+            pass
+    try:
+        # Same compact UTF-8 output as orjson, so results do not depend on
+        # which backend is installed
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+    except UnicodeEncodeError:
+        # Lone surrogates cannot be encoded as UTF-8; escape them instead
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+
+# Anonymous "https://<instance>" per matched instance URL prefix. Full URLs
+# are nearly all unique, but the set of instances in a recording is small,
+# so this stays bounded.
+_instance_url_cache: dict[str, str] = {}
+
+# Patterns are compiled once; the module-level re.sub() cache lookup is
+# measurable when called for every string of every recorded exchange.
+_INSTANCE_URL_RE = re.compile(r'https?://([a-zA-Z0-9][-a-zA-Z0-9]*\.)+[a-zA-Z]{2,}')
+_STRIP_SCHEME_RE = re.compile(r'^https?://')
+
+# Placeholder values written in place of sensitive data. Final lets mypyc
+# compile them to static constants instead of module attribute lookups.
+_BEARER_AUTH: Final = "Bearer anonymous_token_xxx"
+_OTHER_AUTH: Final = "anonymous_auth"
+_SESSION_COOKIE: Final = "_mastodon_session=anonymous_session"
+_NOTE_HTML: Final = "<p>This is an anonymized user bio.</p>"
+_AVATAR_URL: Final = "https://example.com/avatars/original/missing.png"
+_HEADER_URL: Final = "https://example.com/headers/original/missing.png"
+_ACCESS_TOKEN: Final = "anonymous_access_token_xxx"
+_TOKEN: Final = "anonymous_token_xxx"
+_MEDIA_ORIGINAL_URL: Final = "https://example.com/media/original/anonymized.jpg"
+_MEDIA_SMALL_URL: Final = "https://example.com/media/small/anonymized.jpg"
+
+
+# Anonymous names are derived from a keyed hash of the original value rather
+# than a counter, so they need no shared state: every worker process given
+# the same key maps a value identically, and memory use does not grow with
+# the recording. The key keeps names from being reversed by hashing guessed
+# instance names or usernames; it is random per run unless set explicitly.
+_hash_key = secrets.token_bytes(32)
+
+
+def set_hash_key(key: bytes) -> None:
+    """Set the secret key for anonymous names (at most 64 bytes).
+
+    All processes anonymizing the same recording must use the same key.
+    """
+    global _hash_key
+    _hash_key = key
+    # Cached names were derived from the previous key
+    _instance_url_cache.clear()
+
+
+def hash_key_from_salt(salt: str) -> bytes:
+    """Derive a hash key from a user-supplied salt string."""
+    return hashlib.blake2b(salt.encode(), digest_size=32).digest()
+
+
+def _hash_number(original: str) -> int:
+    """Map a string to a stable number (56 bits, so IDs fit in an i64)."""
+    digest = hashlib.blake2b(original.encode(), digest_size=7, key=_hash_key).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def get_anonymous_id(original_id: str) -> str:
+    """Generate a consistent anonymous ID for a given original ID."""
+    return str(100000 + _hash_number(original_id))
+
+
+def get_anonymous_username(original: str) -> str:
+    """Generate a consistent anonymous username."""
+    return f"user{_hash_number(original)}"
+
+
+def get_anonymous_instance(original: str) -> str:
+    """Generate a consistent anonymous instance name."""
+    return f"instance{_hash_number(original)}.example"
+
+
+def _replace_instance_match(m: re.Match[str]) -> str:
+    instance = m.group(0)
+    anonymized = _instance_url_cache.get(instance)
+    if anonymized is None:
+        # Extract just the domain
+        domain = _STRIP_SCHEME_RE.sub('', instance)
+        anon_domain = get_anonymous_instance(domain)
+        anonymized = _instance_url_cache[instance] = f"https://{anon_domain}"
+    return anonymized
+
+
+def anonymize_instance_url(url: str) -> str:
+    """Replace instance URLs with anonymous versions."""
+    # Match common Mastodon instance URL patterns
+    return _INSTANCE_URL_RE.sub(_replace_instance_match, url)
+
+
+def _anonymize_cookie_values(value: str) -> str:
+    """Replace every non-empty value in a Set-Cookie header with 'anonymous'."""
+    pieces = value.split(";")
+    for i, piece in enumerate(pieces):
+        name, _, cookie_value = piece.partition("=")
+        if cookie_value:
+            pieces[i] = f"{name}=anonymous"
+    return ";".join(pieces)
+
+
+def anonymize_headers(headers: dict[str, str]) -> dict[str, str]:
+    """Anonymize sensitive headers."""
+    result: dict[str, str] = {}
+    for key, value in headers.items():
+        key_lower = key.lower()
+        if key_lower == "content-length":
+            # Skip content-length as body size changes after anonymization
+            continue
+        elif key_lower == "authorization":
+            # Replace Bearer token
+            if value.startswith("Bearer "):
+                result[key] = _BEARER_AUTH
+            else:
+                result[key] = _OTHER_AUTH
+        elif key_lower == "cookie":
+            result[key] = _SESSION_COOKIE
+        elif key_lower == "set-cookie":
+            # Preserve cookie structure but anonymize values
+            result[key] = _anonymize_cookie_values(value)
+        elif key_lower in ("host", "origin", "referer"):
+            result[key] = anonymize_instance_url(value)
+        else:
+            result[key] = value
+    return result
+
+
+def anonymize_string_value(value: str) -> str:
+    """Anonymize string values that might contain sensitive data."""
+    # Don't anonymize short strings that are likely enum values
+    if len(value) < 5:
+        return value
+
+    # Anonymize URLs (first-char test rejects most plain text cheaply)
+    if value[0] == "h" and value.startswith(("http://", "https://")):
+        return anonymize_instance_url(value)
+
+    # Anonymize email-like patterns
+    if "@" in value and "." in value:
+        parts = value.split("@")
+        if len(parts) == 2:
+            return f"{get_anonymous_username(parts[0])}@{get_anonymous_instance(parts[1])}"
+
+    return value
+
+
+# Handlers for specific Mastodon API fields, keyed by field name. Each takes
+# the field value and returns the anonymized value, or _GENERIC when the
+# value has an unexpected type and should be anonymized like any other field.
+_GENERIC = object()
+
+
+def _h_id(value: Any) -> Any:
+    if isinstance(value, str):
+        return get_anonymous_id(value)
+    return _GENERIC
+
+
+def _h_url(value: Any) -> Any:
+    if isinstance(value, str):
+        return anonymize_instance_url(value)
+    return _GENERIC
+
+
+def _h_username(value: Any) -> Any:
+    if isinstance(value, str):
+        return get_anonymous_username(value)
+    return _GENERIC
+
+
+def _h_acct(value: Any) -> Any:
+    if not isinstance(value, str):
+        return _GENERIC
+    # Handle both local (username) and remote (username@instance) formats
+    if "@" in value:
+        parts = value.split("@")
+        return f"{get_anonymous_username(parts[0])}@{get_anonymous_instance(parts[1])}"
+    return get_anonymous_username(value)
+
+
+def _h_display_name(value: Any) -> Any:
+    if isinstance(value, str):
+        return f"Anonymous User {get_anonymous_username(value)}"
+    return _GENERIC
+
+
+def _h_email(value: Any) -> Any:
+    if isinstance(value, str):
+        return f"{get_anonymous_username(value.split('@')[0])}@example.com"
+    return _GENERIC
+
+
+def _h_note(value: Any) -> Any:
+    if isinstance(value, str):
+        # User bio - replace with placeholder
+        return _NOTE_HTML
+    return _GENERIC
+
+
+def _h_content(value: Any) -> Any:
+    if isinstance(value, str):
+        # Post content - keep HTML structure but anonymize mentions/links
+        return anonymize_html_content(value)
+    return _GENERIC
+
+
+def _h_avatar(value: Any) -> Any:
+    return _AVATAR_URL
+
+
+def _h_header(value: Any) -> Any:
+    return _HEADER_URL
+
+
+def _h_access_token(value: Any) -> Any:
+    if isinstance(value, str):
+        return _ACCESS_TOKEN
+    return _GENERIC
+
+
+def _h_token(value: Any) -> Any:
+    if isinstance(value, str):
+        return _TOKEN
+    return _GENERIC
+
+
+def _h_timestamp(value: Any) -> Any:
+    # Keep timestamps but normalize them
+    return value  # Keep as-is for now
+
+
+def _h_media_attachments(value: Any) -> Any:
+    if isinstance(value, list):
+        return [anonymize_media_attachment(m) for m in value]
+    return _GENERIC
+
+
+_FIELD_HANDLERS: dict[str, Callable[[Any], Any]] = {
+    "id": _h_id,
+    "uri": _h_url,
+    "url": _h_url,
+    "username": _h_username,
+    "acct": _h_acct,
+    "display_name": _h_display_name,
+    "email": _h_email,
+    "note": _h_note,
+    "content": _h_content,
+    "avatar": _h_avatar,
+    "avatar_static": _h_avatar,
+    "header": _h_header,
+    "header_static": _h_header,
+    "access_token": _h_access_token,
+    "token": _h_token,
+    "created_at": _h_timestamp,
+    "updated_at": _h_timestamp,
+    "edited_at": _h_timestamp,
+    "last_status_at": _h_timestamp,
+    "media_attachments": _h_media_attachments,
+}
+
+
+def anonymize_json_value(value: Any) -> Any:
+    """Anonymize a JSON value, including all nested objects and arrays.
+
+    The document is walked with an explicit stack instead of recursion, so
+    there is no per-level call overhead and no nesting depth limit. Nested
+    containers get a placeholder in their parent (keeping key order) that is
+    filled in when the container is popped.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return anonymize_string_value(value)
+    if value_type is not dict and value_type is not list:
+        return value
+
+    get_handler = _FIELD_HANDLERS.get
+    root: list[Any] = [None]
+    stack: list[tuple[Any, Any, Any]] = [(root, 0, value)]
+
+    while stack:
+        parent, slot, node = stack.pop()
+
+        is_object = type(node) is dict
+        out: Any
+        key: Any
+        items: Iterable[tuple[Any, Any]]
+        if is_object:
+            out = {}
+            items = node.items()
+        else:
+            out = [None] * len(node)
+            items = enumerate(node)
+        parent[slot] = out
+
+        for key, item in items:
+            # "account" and "reblog" have no handler and are walked below
+            if is_object:
+                handler = get_handler(key)
+                if handler is not None:
+                    anonymized = handler(item)
+                    if anonymized is not _GENERIC:
+                        out[key] = anonymized
+                        continue
+
+            item_type = type(item)
+            if item_type is dict or item_type is list:
+                out[key] = None
+                stack.append((out, key, item))
+            elif item_type is str:
+                out[key] = anonymize_string_value(item)
+            else:
+                out[key] = item
+
+    return root[0]
+
+
+# Placeholder URLs for media attachment fields (only replaced if present)
+_MEDIA_URL_OVERRIDES = {
+    "url": _MEDIA_ORIGINAL_URL,
+    "preview_url": _MEDIA_SMALL_URL,
+    "remote_url": _MEDIA_ORIGINAL_URL,
+}
+
+
+def anonymize_media_attachment(attachment: dict[str, Any]) -> dict[str, Any]:
+    """Anonymize a media attachment object."""
+    # Copy and replace the URLs in one pass, keeping the key order
+    get_override = _MEDIA_URL_OVERRIDES.get
+    result = {key: get_override(key, value) for key, value in attachment.items()}
+    if "id" in result:
+        result["id"] = get_anonymous_id(str(result["id"]))
+    return result
+
+
+def _replace_delimited(text: str, opener: str, closer: str,
+                       replace: Callable[[str], str]) -> str:
+    """Rewrite the non-empty text between each opener and closer.
+
+    Equivalent to re.sub(opener + '([^c]+)' + closer) where c is the first
+    character of closer, but done with str.find() since the patterns are
+    plain strings.
+    """
+    stop = closer[0]
+    parts: list[str] = []
+    last = 0
+    pos = text.find(opener)
+    while pos != -1:
+        start = pos + len(opener)
+        end = text.find(stop, start)
+        if end == -1:
+            break
+        if end > start and text.startswith(closer, end):
+            parts.append(text[last:start])
+            parts.append(replace(text[start:end]))
+            last = end
+            pos = text.find(opener, end + len(closer))
+        else:
+            pos = text.find(opener, pos + 1)
+
+    if not parts:
+        return text
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+def anonymize_html_content(html: str) -> str:
+    """Anonymize HTML content while preserving structure."""
+    # Replace @mentions
+    html = _replace_delimited(html, '@<span>', '</span>', get_anonymous_username)
+    # Replace href links
+    html = _replace_delimited(html, 'href="', '"', anonymize_instance_url)
+    return html
+
+
+def anonymize_body(body: str, embed: bool = False) -> Any:
+    """Anonymize a JSON body; non-JSON bodies are returned unchanged.
+
+    With embed=True the anonymized body is returned as parsed JSON, so it is
+    serialized only once as part of the exchange instead of as a nested
+    JSON string.
+    """
+    try:
+        anonymized = anonymize_json_value(_json_loads(body))
+    except json.JSONDecodeError:
+        return body
+    return anonymized if embed else _json_dumps(anonymized).decode()
+
+
+def anonymize_exchange(exchange: dict[str, Any], embed_bodies: bool = False) -> dict[str, Any]:
+    """Anonymize a complete request/response exchange."""
+    result: dict[str, Any] = {
+        "timestamp": exchange.get("timestamp", "2025-01-01T00:00:00Z"),
+    }
+
+    # Anonymize request
+    if "request" in exchange:
+        req = exchange["request"]
+        result["request"] = {
+            "method": req.get("method", "GET"),
+            "path": req.get("path", "/"),
+            "headers": anonymize_headers(req.get("headers", {})),
+        }
+        if "body" in req and req["body"]:
+            result["request"]["body"] = anonymize_body(req["body"], embed_bodies)
+
+    # Anonymize response
+    if "response" in exchange:
+        resp = exchange["response"]
+        result["response"] = {
+            "status": resp.get("status", 200),
+            "headers": anonymize_headers(resp.get("headers", {})),
+        }
+        if "body" in resp:
+            result["response"]["body"] = anonymize_body(resp["body"], embed_bodies)
+
+    return result
+
+
+def anonymize_line(line: bytes, embed_bodies: bool = False) -> bytes | None:
+    """Anonymize one JSONL record; returns None for invalid JSON."""
+    try:
+        return _json_dumps(anonymize_exchange(_json_loads(line), embed_bodies))
+    except json.JSONDecodeError as e:
+        print(f"Warning: Skipping invalid JSON line: {e}", file=sys.stderr)
+        return None
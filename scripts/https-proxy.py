@@ -6,52 +6,109 @@ Forwards https://localhost:8443 -> http://localhost:8080
 
 import http.server
 import http.client
+import shutil
 import ssl
 import sys
 import os
+import threading
 
 LISTEN_PORT = 443
 UPSTREAM_HOST = "localhost"
 UPSTREAM_PORT = 8080
 
+# Read/write size when streaming bodies between client and upstream
+CHUNK_SIZE = 65536
+# Request bodies up to this size are read into memory, so a request on a
+# stale pooled connection can be resent; larger ones are streamed
+MAX_BUFFERED_BODY = 65536
+
+# Request headers not forwarded upstream (hop-by-hop)
+_HOP_BY_HOP = frozenset({
+    'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer',
+    'upgrade', 'proxy-authorization', 'proxy-authenticate',
+})
+# Response headers not copied as-is (Set-Cookie is forwarded separately)
+_RESP_SKIP = frozenset({'transfer-encoding', 'connection', 'set-cookie'})
+
+# Idle keep-alive connections to upstream, shared by all handler threads
+UPSTREAM_POOL_SIZE = 8
+_upstream_pool: list[http.client.HTTPConnection] = []
+_upstream_pool_lock = threading.Lock()
+
+
+def acquire_upstream():
+    """Return (connection, reused), preferring an idle pooled connection."""
+    with _upstream_pool_lock:
+        if _upstream_pool:
+            return _upstream_pool.pop(), True
+    return http.client.HTTPConnection(UPSTREAM_HOST, UPSTREAM_PORT), False
+
+
+def release_upstream(conn):
+    """Put a connection whose response was fully read back into the pool."""
+    with _upstream_pool_lock:
+        if len(_upstream_pool) < UPSTREAM_POOL_SIZE:
+            _upstream_pool.append(conn)
+            return
+    conn.close()
+
+
+class ProxyServer(http.server.ThreadingHTTPServer):
+    # Browsers open several connections at once when loading the web client
+    request_queue_size = 64
+
 
 class ProxyHandler(http.server.BaseHTTPRequestHandler):
     protocol_version = "HTTP/1.1"
+    # Small API responses and headers should not wait on Nagle's algorithm
+    disable_nagle_algorithm = True
 
     def do_proxy(self):
-        # Read request body if present
-        content_length = self.headers.get('Content-Length')
+        # Buffer small request bodies, stream large ones
+        content_length = int(self.headers.get('Content-Length') or 0)
         body = None
-        if content_length:
-            body = self.rfile.read(int(content_length))
-
-        # Connect to upstream
-        conn = http.client.HTTPConnection(UPSTREAM_HOST, UPSTREAM_PORT)
+        if content_length > MAX_BUFFERED_BODY:
+            body = self.iter_body(content_length)
+        elif content_length:
+            body = self.rfile.read(content_length)
+        elif 'Transfer-Encoding' in self.headers:
+            # Chunked request bodies are not forwarded; the rest of the
+            # connection cannot be parsed reliably, so do not reuse it
+            self.close_connection = True
+
+        # Connect to upstream. A streamed body cannot be replayed, so it is
+        # never sent over a pooled connection that may have gone stale
+        if content_length > MAX_BUFFERED_BODY:
+            conn, reused = http.client.HTTPConnection(UPSTREAM_HOST, UPSTREAM_PORT), False
+        else:
+            conn, reused = acquire_upstream()
 
         # Build headers (pass through all except hop-by-hop)
-        headers = {}
-        hop_by_hop = ('connection', 'keep-alive', 'transfer-encoding',
-                      'te', 'trailer', 'upgrade', 'proxy-authorization',
-                      'proxy-authenticate')
-        for key, value in self.headers.items():
-            if key.lower() not in hop_by_hop:
-                headers[key] = value
+        headers = {key: value for key, value in self.headers.items()
+                   if key.lower() not in _HOP_BY_HOP}
 
         try:
-            conn.request(self.command, self.path, body=body, headers=headers)
-            resp = conn.getresponse()
+            try:
+                conn.request(self.command, self.path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.BadStatusLine, ConnectionError):
+                # Upstream may have dropped an idle pooled connection; retry
+                # once on a fresh one
+                conn.close()
+                if not reused:
+                    raise
+                conn = http.client.HTTPConnection(UPSTREAM_HOST, UPSTREAM_PORT)
+                conn.request(self.command, self.path, body=body, headers=headers)
+                resp = conn.getresponse()
 
             # Send response status
             self.send_response_only(resp.status, resp.reason)
 
             # Forward all response headers
-            # Note: getheaders() combines Set-Cookie headers, we need them separate
+            # Note: getheaders() combines Set-Cookie headers, we need them separate,
+            # so they are skipped here and handled below
             for key, value in resp.getheaders():
-                if key.lower() == 'set-cookie':
-                    # Handle multiple cookies (they come combined with ', ' but that breaks parsing)
-                    # Actually resp.msg.get_all() gives us the raw headers
-                    continue  # Handle below
-                elif key.lower() not in ('transfer-encoding', 'connection'):
+                if key.lower() not in _RESP_SKIP:
                     self.send_header(key, value)
 
             # Handle Set-Cookie headers separately (each must be its own header)
@@ -60,16 +117,57 @@ class ProxyHandler(http.server.BaseHTTPRequestHandler):
                 for cookie in cookies:
                     self.send_header('Set-Cookie', cookie)
 
-            self.send_header('Connection', 'close')
+            # Keep the client connection alive whenever the body framing is
+            # known: Content-Length is forwarded as-is, chunked bodies are
+            # re-chunked below. Only close-delimited bodies need a close.
+            # HTTP/1.0 clients cannot parse chunked framing, so they get the
+            # decoded body delimited by closing the connection instead.
+            has_body = not (self.command == 'HEAD' or resp.status in (204, 304)
+                            or 100 <= resp.status < 200)
+            rechunk = (resp.chunked and has_body
+                       and self.request_version != 'HTTP/1.0')
+            if rechunk:
+                self.send_header('Transfer-Encoding', 'chunked')
+            elif has_body and resp.getheader('Content-Length') is None:
+                self.close_connection = True
+            if self.close_connection:
+                self.send_header('Connection', 'close')
             self.end_headers()
 
-            # Forward response body
-            self.wfile.write(resp.read())
+            if not has_body:
+                # Nothing follows the headers on the wire; closing the
+                # response marks the upstream connection as reusable
+                resp.close()
+            elif rechunk:
+                # read1() returns data as it arrives, so streamed responses
+                # are not held back until a full chunk has been buffered
+                write = self.wfile.write
+                while chunk := resp.read1(CHUNK_SIZE):
+                    write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                write(b"0\r\n\r\n")
+            else:
+                # Stream the response body
+                shutil.copyfileobj(resp, self.wfile, CHUNK_SIZE)
+
+            # Only reuse the connection once the response is fully consumed
+            if resp.isclosed() and not resp.will_close:
+                release_upstream(conn)
+                conn = None
 
         except Exception as e:
             self.send_error(502, f"Upstream error: {e}")
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
+
+    def iter_body(self, length):
+        """Yield the request body in chunks without buffering all of it."""
+        while length > 0:
+            chunk = self.rfile.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
 
     def do_GET(self): self.do_proxy()
     def do_POST(self): self.do_proxy()
@@ -97,8 +195,11 @@ def main():
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     context.load_cert_chain(cert_file, key_file)
 
-    server = http.server.HTTPServer(("0.0.0.0", LISTEN_PORT), ProxyHandler)
-    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server = ProxyServer(("0.0.0.0", LISTEN_PORT), ProxyHandler)
+    # Defer the TLS handshake to the first read in the handler thread, so a
+    # slow handshake does not block accept() for every other client
+    server.socket = context.wrap_socket(server.socket, server_side=True,
+                                        do_handshake_on_connect=False)
 
     print(f"HTTPS proxy running on https://localhost")
     print(f"Forwarding to http://{UPSTREAM_HOST}:{UPSTREAM_PORT}")
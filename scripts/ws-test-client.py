@@ -6,7 +6,9 @@ Tests WebSocket streaming and shows deduplication in action.
 Connects to the proxy and displays incoming statuses with their URIs.
 
 Usage:
-    ./scripts/ws-test-client.py [--token TOKEN] [--stream public|user]
+    ./scripts/ws-test-client.py [--token TOKEN] [--stream public|user] [--quiet]
+
+uvloop and orjson are used if installed, which helps on busy public streams.
 
 You can get a token by logging in via web browser and copying from dev tools.
 """
@@ -16,6 +18,7 @@ import argparse
 import json
 import ssl
 import sys
+from collections import OrderedDict
 
 try:
     import websockets
@@ -23,8 +26,19 @@ except ImportError:
     print("Error: websockets library required. Install with: pip install websockets")
     sys.exit(1)
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Most recent URIs remembered for the duplicate check, so memory stays
+# bounded on endless streams
+MAX_SEEN_URIS = 200_000
+
 
-async def stream_timeline(host: str, port: int, token: str | None, stream: str, use_ssl: bool):
+async def stream_timeline(host: str, port: int, token: str | None, stream: str, use_ssl: bool,
+                          quiet: bool = False):
     """Connect to WebSocket streaming API and display events."""
 
     protocol = "wss" if use_ssl else "ws"
@@ -44,7 +58,8 @@ async def stream_timeline(host: str, port: int, token: str | None, stream: str,
         ssl_ctx.check_hostname = False
         ssl_ctx.verify_mode = ssl.CERT_NONE
 
-    seen_uris = set()
+    seen_uris: OrderedDict[str, None] = OrderedDict()
+    unique_uris = 0
     total_received = 0
     duplicates_filtered = 0
 
@@ -53,46 +68,55 @@ async def stream_timeline(host: str, port: int, token: str | None, stream: str,
             print(f"Connected! Listening for {stream} stream events...")
             print("(Press Ctrl+C to stop)\n")
 
+            write = sys.stdout.write
             async for message in ws:
                 try:
-                    data = json.loads(message)
+                    data = json_loads(message)
                     event_type = data.get("event", "unknown")
 
                     if event_type == "update":
                         total_received += 1
-                        payload = json.loads(data.get("payload", "{}"))
+                        payload = json_loads(data.get("payload", "{}"))
 
                         uri = payload.get("uri", "no-uri")
-                        account = payload.get("account", {}).get("acct", "unknown")
-                        content = payload.get("content", "")[:80]
-                        reblog = payload.get("reblog")
 
                         # Check if this is a duplicate (for our tracking)
                         is_dup = uri in seen_uris
-                        seen_uris.add(uri)
+                        if is_dup:
+                            seen_uris.move_to_end(uri)
+                        else:
+                            unique_uris += 1
+                            seen_uris[uri] = None
+                            if len(seen_uris) > MAX_SEEN_URIS:
+                                seen_uris.popitem(last=False)
 
                         if is_dup:
                             duplicates_filtered += 1
-                            print(f"[DUP #{duplicates_filtered}] Would have been duplicate: {uri[:50]}...")
-                        else:
+                            if not quiet:
+                                write(f"[DUP #{duplicates_filtered}] Would have been duplicate: {uri[:50]}...\n")
+                        elif not quiet:
+                            account = payload.get("account", {}).get("acct", "unknown")
+                            reblog = payload.get("reblog")
                             if reblog:
                                 orig_uri = reblog.get("uri", "?")
                                 orig_account = reblog.get("account", {}).get("acct", "?")
-                                print(f"[BOOST] @{account} boosted @{orig_account}")
-                                print(f"        URI: {orig_uri[:60]}")
+                                write(f"[BOOST] @{account} boosted @{orig_account}\n"
+                                      f"        URI: {orig_uri[:60]}\n\n")
                             else:
-                                print(f"[POST]  @{account}")
-                                print(f"        URI: {uri[:60]}")
-                            print()
+                                write(f"[POST]  @{account}\n"
+                                      f"        URI: {uri[:60]}\n\n")
+
+                    elif quiet:
+                        continue
 
                     elif event_type == "notification":
-                        print(f"[NOTIF] {data.get('payload', '')[:60]}...")
+                        write(f"[NOTIF] {data.get('payload', '')[:60]}...\n")
 
                     elif event_type == "delete":
-                        print(f"[DEL]   Status deleted: {data.get('payload', '')}")
+                        write(f"[DEL]   Status deleted: {data.get('payload', '')}\n")
 
                     else:
-                        print(f"[{event_type.upper()}] {str(data)[:60]}...")
+                        write(f"[{event_type.upper()}] {str(data)[:60]}...\n")
 
                 except json.JSONDecodeError:
                     print(f"[RAW] {message[:100]}...")
@@ -107,7 +131,7 @@ async def stream_timeline(host: str, port: int, token: str | None, stream: str,
         print("\n" + "=" * 60)
         print(f"Session stats:")
         print(f"  Total events received: {total_received}")
-        print(f"  Unique URIs seen: {len(seen_uris)}")
+        print(f"  Unique URIs seen: {unique_uris}")
         print(f"  Duplicates (client-side check): {duplicates_filtered}")
         print("=" * 60)
 
@@ -120,6 +144,8 @@ def main():
     parser.add_argument("--stream", default="public", choices=["public", "user", "public:local"],
                         help="Stream type (default: public)")
     parser.add_argument("--ssl", action="store_true", help="Use SSL/TLS (wss://)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Only print session stats, not every event")
 
     args = parser.parse_args()
 
@@ -129,12 +155,19 @@ def main():
         sys.exit(1)
 
     try:
-        asyncio.run(stream_timeline(
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+
+    try:
+        run(stream_timeline(
             host=args.host,
             port=args.port,
             token=args.token,
             stream=args.stream,
-            use_ssl=args.ssl
+            use_ssl=args.ssl,
+            quiet=args.quiet
         ))
     except KeyboardInterrupt:
         print("\nStopped.")